@@ -1,23 +1,40 @@
 import sys
 import os
 import json
+import time
+import threading
+import concurrent.futures
 import pytest
 from unittest.mock import patch, MagicMock
 
 # Ensure src/ is in the Python path so `agent` can be imported
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../src")))
 
+import agent.cli as cli
 from agent.cli import (
     GenerateQueries, WebSearchTool, Reflect, Synthesize,
-    Graph, Edge
+    Graph, Edge, Node, cached_generate, generate_async, build_pipeline, run_topic
 )
 
+def mock_gemini(**kwargs):
+    # The Gemini model is built lazily, so patch the factory rather than a module global
+    return patch("agent.cli._get_model", return_value=MagicMock(generate_content=MagicMock(**kwargs)))
+
+@pytest.fixture(autouse=True)
+def clear_caches():
+    # Each test gets empty in-memory caches, never touches the on-disk ones,
+    # and sees no SerpAPI rate limiting carried over from earlier tests
+    with patch("agent.cli._llm_cache", return_value=cli.MemoryCache()), \
+         patch("agent.cli._search_cache", return_value=cli.MemoryCache()), \
+         patch("agent.cli._SERP_LIMITER", MagicMock()):
+        yield
+
 @pytest.fixture
 def dummy_input():
     return {"topic": "Who won the 2022 FIFA World Cup?"}
 
 def test_happy_path(dummy_input):
-    def gemini_side_effect(prompt):
+    def gemini_side_effect(prompt, **kwargs):
         if "Break the following research question" in prompt:
             return MagicMock(text=json.dumps([
                 "2022 FIFA World Cup winner",
@@ -31,17 +48,15 @@ def test_happy_path(dummy_input):
         else:
             return MagicMock(text="{}")
 
-    with patch("agent.cli.GEN_MODEL.generate_content", side_effect=gemini_side_effect), \
-         patch("agent.cli.GoogleSearch") as mock_serp:
+    with mock_gemini(side_effect=gemini_side_effect), \
+         patch("agent.cli._HTTP.get") as mock_get:
 
-        mock_search_instance = MagicMock()
-        mock_search_instance.get_dict.return_value = {
+        mock_get.return_value.json.return_value = {
             "organic_results": [
                 {"title": "Argentina wins", "link": "https://example.com/a"},
                 {"title": "World Cup final", "link": "https://example.com/b"},
             ]
         }
-        mock_serp.return_value = mock_search_instance
 
         graph = Graph(
             nodes={
@@ -67,15 +82,13 @@ def test_happy_path(dummy_input):
         assert result["citations"][0]["id"] == 1
 
 def test_no_results(dummy_input):
-    with patch("agent.cli.GEN_MODEL.generate_content", return_value=MagicMock(text=json.dumps(["some irrelevant query"]))), \
-         patch("agent.cli.GoogleSearch") as mock_serp:
+    with mock_gemini(return_value=MagicMock(text=json.dumps(["some irrelevant query"]))), \
+         patch("agent.cli._HTTP.get") as mock_get:
 
-        mock_search_instance = MagicMock()
-        mock_search_instance.get_dict.return_value = {"organic_results": []}
-        mock_serp.return_value = mock_search_instance
+        mock_get.return_value.json.return_value = {"organic_results": []}
 
         # Also patch synthesis step
-        with patch("agent.cli.GEN_MODEL.generate_content", return_value=MagicMock(text=json.dumps({
+        with mock_gemini(return_value=MagicMock(text=json.dumps({
             "answer": "No relevant documents found to answer the question.",
             "citations": []
         }))):
@@ -101,9 +114,9 @@ def test_no_results(dummy_input):
             assert result["citations"] == []
 
 def test_http_429(dummy_input):
-    with patch("agent.cli.GEN_MODEL.generate_content", return_value=MagicMock(text=json.dumps(["rate limited search"]))), \
-         patch("agent.cli.GoogleSearch", side_effect=Exception("429 Too Many Requests")), \
-         patch("agent.cli.GEN_MODEL.generate_content", return_value=MagicMock(text=json.dumps({
+    with mock_gemini(return_value=MagicMock(text=json.dumps(["rate limited search"]))), \
+         patch("agent.cli._HTTP.get", side_effect=Exception("429 Too Many Requests")), \
+         mock_gemini(return_value=MagicMock(text=json.dumps({
              "answer": "No relevant documents found to answer the question.",
              "citations": []
          }))):
@@ -129,9 +142,9 @@ def test_http_429(dummy_input):
         assert result["citations"] == []
 
 def test_timeout(dummy_input):
-    with patch("agent.cli.GEN_MODEL.generate_content", return_value=MagicMock(text=json.dumps(["timeout query"]))), \
-         patch("agent.cli.GoogleSearch", side_effect=TimeoutError("Timeout")), \
-         patch("agent.cli.GEN_MODEL.generate_content", return_value=MagicMock(text=json.dumps({
+    with mock_gemini(return_value=MagicMock(text=json.dumps(["timeout query"]))), \
+         patch("agent.cli._HTTP.get", side_effect=TimeoutError("Timeout")), \
+         mock_gemini(return_value=MagicMock(text=json.dumps({
              "answer": "No relevant documents found to answer the question.",
              "citations": []
          }))):
@@ -157,7 +170,7 @@ def test_timeout(dummy_input):
         assert result["answer"].startswith("No relevant")
 
 def test_two_round_supplement(dummy_input):
-    def gemini_side_effect(prompt):
+    def gemini_side_effect(prompt, **kwargs):
         if "Break the following research question" in prompt:
             return MagicMock(text=json.dumps(["first query"]))
         elif "Answer this research question" in prompt:
@@ -167,12 +180,10 @@ def test_two_round_supplement(dummy_input):
             }))
         return MagicMock(text="{}")
 
-    with patch("agent.cli.GEN_MODEL.generate_content", side_effect=gemini_side_effect), \
-         patch("agent.cli.GoogleSearch") as mock_serp:
+    with mock_gemini(side_effect=gemini_side_effect), \
+         patch("agent.cli._HTTP.get") as mock_get:
 
-        mock_search_instance = MagicMock()
-        mock_search_instance.get_dict.return_value = {"organic_results": []}
-        mock_serp.return_value = mock_search_instance
+        mock_get.return_value.json.return_value = {"organic_results": []}
 
         graph = Graph(
             nodes={
@@ -193,3 +204,346 @@ def test_two_round_supplement(dummy_input):
 
         result = graph.run(dummy_input)
         assert result["answer"].startswith("No relevant")
+
+def test_parallel_fan_out():
+    class Emit(Node):
+        def __init__(self, key):
+            self.key = key
+
+        def run(self, input_data):
+            return {self.key: True}
+
+    graph = Graph(
+        nodes={"start": Emit("start"), "left": Emit("left"), "right": Emit("right"), "end": Emit("end")},
+        edges=[
+            Edge("start", "left"),
+            Edge("start", "right"),
+            Edge("left", "end"),
+            Edge("right", "end"),
+        ],
+        entry="start",
+        exit="end",
+        max_iter=2
+    )
+
+    result = graph.run({})
+    assert result == {"start": True, "left": True, "right": True, "end": True}
+    assert graph._levels == [["start"], ["left", "right"], ["end"]]
+
+def test_graph_skips_exit_when_answer_present():
+    class Answer(Node):
+        def run(self, input_data):
+            return {"answer": "Argentina [1]", "citations": [{"id": 1}]}
+
+    exit_node = MagicMock()
+    graph = Graph(nodes={"answer": Answer(), "end": exit_node}, edges=[Edge("answer", "end")], entry="answer", exit="end")
+
+    assert graph.run({})["answer"] == "Argentina [1]"
+    exit_node.run.assert_not_called()
+
+def test_reflect_skips_llm_when_titles_match_topic(dummy_input):
+    docs = [{"title": f"World Cup final report {i}", "url": f"https://example.com/{i}"} for i in range(6)]
+
+    with mock_gemini() as mock_model:
+        result = Reflect().run(dict(dummy_input, docs=docs))
+
+    mock_model.assert_not_called()
+    assert result["need_more"] is False
+    assert result["skipped"] is True
+    assert result["filled"] == []
+
+def test_generate_queries_strips_code_fences():
+    for text in ['```json\n["a", "b"]\n```', '```json\n["a", "b"]```', '["a", "b"]']:
+        with patch("agent.cli.cached_generate", return_value=text):
+            assert GenerateQueries().run({"topic": "anything"}) == {"queries": ["a", "b"]}
+
+def test_llm_cache_hit():
+    with mock_gemini(return_value=MagicMock(text="cached")) as mock_model:
+        assert cached_generate("same prompt") == "cached"
+        assert cached_generate("same prompt") == "cached"
+        assert mock_model.return_value.generate_content.call_count == 1
+
+def test_refinement_docs_merged(dummy_input):
+    refinement = concurrent.futures.Future()
+    refinement.set_result({"docs": [
+        {"title": "Argentina wins", "url": "https://example.com/a"},
+        {"title": "Final report", "url": "https://example.com/c"},
+    ]})
+    data = dict(dummy_input, docs=[{"title": "Argentina wins", "url": "https://example.com/a"}], refinement=refinement)
+
+    with mock_gemini(return_value=MagicMock(text=json.dumps({"answer": "Argentina [1][2]", "citations": []}))) as mock_model:
+        Synthesize().run(data)
+
+    prompt = mock_model.return_value.generate_content.call_args[0][0]
+    assert "https://example.com/c" in prompt
+    assert prompt.count("https://example.com/a") == 1
+
+def test_refinement_docs_reach_prompt_after_full_first_round(dummy_input):
+    first_round = [{"title": f"Result {i}", "url": f"https://example.com/{i}"} for i in range(8)]
+    refinement = concurrent.futures.Future()
+    refinement.set_result({"docs": [{"title": "Final report", "url": "https://example.com/final"}]})
+    data = dict(dummy_input, docs=first_round, doc_block=cli._doc_block(first_round), refinement=refinement)
+
+    with mock_gemini(return_value=MagicMock(text=json.dumps({"answer": "Argentina [5]", "citations": []}))) as mock_model:
+        Synthesize().run(data)
+
+    prompt = mock_model.return_value.generate_content.call_args[0][0]
+    assert "[5] Final report - https://example.com/final" in prompt
+    assert "https://example.com/4" not in prompt
+
+def test_synthesize_reuses_last_answer(dummy_input):
+    data = dict(dummy_input, docs=[{"title": "Argentina wins", "url": "https://example.com/a"}])
+    node = Synthesize()
+
+    with patch("agent.cli.cached_generate", return_value=json.dumps({"answer": "Argentina [1]", "citations": []})) as mock_generate:
+        first = node.run(data)
+        second = node.run(data)
+        node.run(dict(data, topic="Who won the 2018 FIFA World Cup?"))
+
+    assert second == first
+    assert mock_generate.call_count == 2
+
+def test_synthesize_parses_json_wrapped_in_prose(dummy_input):
+    data = dict(dummy_input, docs=[{"title": "Argentina wins", "url": "https://example.com/a"}])
+    text = 'Here is the JSON:\n{"answer": "Argentina [1]", "citations": [{"id": 1}]}\nHope this helps!'
+
+    with mock_gemini(return_value=MagicMock(text=text)):
+        result = Synthesize().run(data)
+
+    assert result == {"answer": "Argentina [1]", "citations": [{"id": 1}]}
+
+def test_synthesize_debug_tolerates_malformed_citations(dummy_input, capsys):
+    data = dict(dummy_input, debug=True, docs=[{"title": "Argentina wins", "url": "https://example.com/a"}])
+    text = json.dumps({"answer": "Argentina [1]", "citations": ["x", {"id": 1}, {"id": 2}]})
+
+    with mock_gemini(return_value=MagicMock(text=text)):
+        result = Synthesize().run(data)
+
+    assert result["citations"] == ["x", {"id": 1}, {"id": 2}]
+    assert "not referenced in the answer: [2]" in capsys.readouterr().out
+
+    with mock_gemini(return_value=MagicMock(text=json.dumps({"answer": ["Argentina"], "citations": []}))):
+        result = Synthesize().run(dict(data, docs=[{"title": "Final report", "url": "https://example.com/c"}]))
+    assert result["answer"] == ["Argentina"]
+
+def test_lenient_parse_skips_brackets_in_prose():
+    answer = {"answer": "Argentina [1][2]", "citations": []}
+    for text in [
+        'Based on sources [1] and [2]:\n' + json.dumps(answer),
+        json.dumps(answer) + '\nSee [1] for details.',
+    ]:
+        assert cli._loads_lenient(text) == answer
+    assert cli._loads_lenient('["q1", "q2"]\nThese cover {the topic}.') == ["q1", "q2"]
+    with pytest.raises(cli.orjson.JSONDecodeError):
+        cli._loads_lenient("No JSON here, only {braces} and [brackets")
+
+def test_search_dedups_urls():
+    with patch("agent.cli._HTTP.get") as mock_get:
+        mock_get.return_value.json.return_value = {
+            "organic_results": [
+                {"title": "Argentina wins", "link": "https://example.com/a"},
+                {"title": "No link"},
+                {"title": "World Cup final", "link": "https://example.com/b"},
+                {"title": "Argentina wins (mirror)", "link": "https://example.com/a"},
+            ]
+        }
+        result = WebSearchTool().run({"queries": ["first query", "second query", " First  Query", ""]})
+
+    assert mock_get.call_count == 2
+    assert [doc["url"] for doc in result["docs"]] == ["https://example.com/a", "https://example.com/b"]
+
+    # Malformed entries from the LLM are skipped instead of aborting the run
+    with patch("agent.cli._HTTP.get") as mock_get:
+        WebSearchTool().run({"queries": ["first query", 2, {"query": "x"}, None]})
+    mock_get.assert_not_called()
+    assert result["doc_block"] == "[1] Argentina wins - https://example.com/a\n[2] World Cup final - https://example.com/b"
+
+    # Repeated queries are served from the search cache
+    with patch("agent.cli._HTTP.get") as mock_get:
+        cached = WebSearchTool().run({"queries": ["first query"]})
+
+    mock_get.assert_not_called()
+    assert cached["docs"] == result["docs"]
+
+def test_search_caps_docs_and_titles():
+    with patch("agent.cli._HTTP.get") as mock_get:
+        mock_get.return_value.json.return_value = {
+            "organic_results": [{"title": "x" * 500, "link": f"https://example.com/{i}"} for i in range(50)]
+        }
+        result = WebSearchTool().run({"queries": ["world cup"]})
+
+    assert len(result["docs"]) == cli.MAX_DOCS
+    assert result["doc_block"].splitlines()[0] == f"[1] {'x' * cli.MAX_TITLE_CHARS} - https://example.com/0"
+
+def test_search_retries_429_through_rate_limiter():
+    throttled = MagicMock(status_code=429, headers={"Retry-After": "2"})
+    ok = MagicMock(status_code=200)
+    ok.json.return_value = {"organic_results": [{"title": "Argentina wins", "link": "https://example.com/a"}]}
+
+    with patch("agent.cli._HTTP.get", side_effect=[throttled, ok]), \
+         patch("agent.cli._SERP_LIMITER") as limiter:
+        result = WebSearchTool().run({"queries": ["world cup"]})
+
+    limiter.back_off.assert_called_once_with(2.0)
+    assert limiter.acquire.call_count == 2
+    assert [doc["url"] for doc in result["docs"]] == ["https://example.com/a"]
+
+def test_search_deadline_drops_stragglers(capsys):
+    release = threading.Event()
+
+    def get_side_effect(url, params, timeout):
+        if params["q"].startswith("slow"):
+            release.wait(5)
+        response = MagicMock(status_code=200)
+        response.json.return_value = {"organic_results": [{"title": params["q"], "link": f"https://example.com/{params['q']}"}]}
+        return response
+
+    try:
+        with patch("agent.cli._HTTP.get", side_effect=get_side_effect), \
+             patch("agent.cli.SEARCH_DEADLINE", 0.2):
+            result = WebSearchTool().run({"queries": ["fast query", "slow query"]})
+    finally:
+        release.set()
+
+    assert [doc["title"] for doc in result["docs"]] == ["fast query"]
+    # stdout carries only the JSON result
+    captured = capsys.readouterr()
+    assert "exceeded" in captured.err and captured.out == ""
+
+    # A lone query is bounded by the same deadline
+    release.clear()
+    try:
+        with patch("agent.cli._HTTP.get", side_effect=get_side_effect), \
+             patch("agent.cli.SEARCH_DEADLINE", 0.2):
+            assert WebSearchTool().run({"queries": ["slow lone query"]})["docs"] == []
+    finally:
+        release.set()
+
+def test_search_requests_fit_inside_deadline():
+    retry = cli._new_session().get_adapter(cli.SERPAPI_URL).max_retries
+    assert retry.read is False
+    assert 429 not in retry.status_forcelist
+    assert cli.SEARCH_TIMEOUT < cli.SEARCH_DEADLINE
+
+def test_quick_answer_single_call(dummy_input):
+    with mock_gemini(return_value=MagicMock(text=json.dumps({
+        "queries": ["2022 FIFA World Cup winner"],
+        "answer": "Argentina won the 2022 FIFA World Cup.",
+        "citations": []
+    }))) as mock_model, patch("agent.cli._HTTP.get") as mock_get:
+        result = build_pipeline(quick=True).run(dummy_input)
+
+    assert result["answer"].startswith("Argentina")
+    assert mock_model.return_value.generate_content.call_count == 1
+    mock_get.assert_not_called()
+
+def test_offline_mode(dummy_input):
+    with patch("agent.cli.USE_LLM", False), patch("agent.cli.USE_SEARCH", False), \
+         patch("agent.cli._get_model") as mock_model, patch("agent.cli._HTTP.get") as mock_get:
+        result = build_pipeline().run(dummy_input)
+
+    mock_model.assert_not_called()
+    mock_get.assert_not_called()
+    assert [c["id"] for c in result["citations"]] == [1, 2]
+    assert result["citations"][0]["url"] == "https://example.com/who_won_the_2022_fifa_world_cup?_1"
+
+def test_run_topic_reuses_pipeline(dummy_input):
+    assert build_pipeline() is build_pipeline()
+    assert build_pipeline() is build_pipeline(quick=False) is build_pipeline(False)
+    with patch("agent.cli.USE_LLM", False), patch("agent.cli.USE_SEARCH", False):
+        first = run_topic(dummy_input["topic"])
+        second = run_topic(dummy_input["topic"])
+
+    assert first == second
+    assert set(first) == {"answer", "citations"}
+
+def test_memory_cache_is_bounded_lru():
+    cache = cli.MemoryCache()
+    cache.MAX_ENTRIES = 2
+    cache.set("a", "1", ttl=60)
+    cache.set("b", "2", ttl=60)
+    assert cache.get("a") == "1"
+    cache.set("c", "3", ttl=60)
+    assert cache.get("b") is None
+    assert cache.get("a") == "1" and cache.get("c") == "3"
+
+    cache.set("stale", "value", ttl=-1)
+    assert cache.get("stale") is None
+    assert "stale" not in cache._entries
+
+def test_sqlite_cache_roundtrip(tmp_path):
+    cache = cli.SQLiteCache(str(tmp_path / "llm_cache.sqlite"))
+    cache.set("key", "value", ttl=60)
+    assert cache.get("key") == "value"
+    assert cli.SQLiteCache(str(tmp_path / "llm_cache.sqlite")).get("key") == "value"
+
+    cache.set("stale", "value", ttl=-1)
+    assert cache.get("stale") is None
+    # Reopening the file prunes expired rows
+    reopened = cli.SQLiteCache(str(tmp_path / "llm_cache.sqlite"))
+    assert reopened._conn.execute("SELECT COUNT(*) FROM llm_cache WHERE key = 'stale'").fetchone()[0] == 0
+
+    cache.delete("key")
+    assert cache.get("key") is None
+
+def test_sqlite_cache_serves_repeat_reads_from_memory(tmp_path):
+    cache = cli.SQLiteCache(str(tmp_path / "llm_cache.sqlite"))
+    cache.set("key", "value", ttl=60)
+    cache._conn.execute("DELETE FROM llm_cache")
+    assert cache.get("key") == "value"
+
+    cache.MEMORY_ENTRIES = 1
+    cache.set("other", "value", ttl=60)
+    cache._conn.execute("DELETE FROM llm_cache")
+    assert cache.get("key") is None
+
+def test_llm_cache_normalized_hit():
+    with mock_gemini(return_value=MagicMock(text=json.dumps(["query"]))) as mock_model:
+        GenerateQueries().run({"topic": "Who won the 2022 World Cup?"})
+        GenerateQueries().run({"topic": "  who won the 2022 world cup "})
+        GenerateQueries().run({"topic": "Who won the 2018 World Cup?"})
+        assert mock_model.return_value.generate_content.call_count == 2
+
+def test_llm_cache_keeps_distinct_topics_apart():
+    with mock_gemini(return_value=MagicMock(text=json.dumps(["query"]))) as mock_model:
+        GenerateQueries().run({"topic": "What is C++?"})
+        GenerateQueries().run({"topic": "What is C#?"})
+        GenerateQueries().run({"topic": "what is c++"})
+        assert mock_model.return_value.generate_content.call_count == 2
+
+def test_generate_async_overlaps_calls():
+    prompts = [f"prompt {i}" for i in range(3)]
+    with mock_gemini(side_effect=lambda prompt, **kwargs: MagicMock(text=prompt.upper())):
+        futures = [generate_async(prompt) for prompt in prompts]
+        assert [f.result(timeout=5) for f in futures] == ["PROMPT 0", "PROMPT 1", "PROMPT 2"]
+
+def test_reflect_checks_slots_concurrently(dummy_input):
+    def gemini_side_effect(prompt, **kwargs):
+        return MagicMock(text=json.dumps({"filled": "Slot: winner" in prompt, "explanation": "checked"}))
+
+    data = dict(dummy_input, docs=[{"title": "Argentina wins", "url": "https://example.com/a"}], queries=["q"])
+    with mock_gemini(side_effect=gemini_side_effect) as mock_model, \
+         patch("agent.cli._HTTP.get") as mock_get:
+        mock_get.return_value.json.return_value = {"organic_results": []}
+        result = Reflect().run(data)
+        result["refinement"].result(timeout=5)
+
+    assert mock_model.return_value.generate_content.call_count == 3
+    assert result["filled"] == ["winner"]
+    assert result["need_more"] is True
+    assert len(result["new_queries"]) == 2
+
+def test_stream_stops_at_end_of_json():
+    chunks = [MagicMock(text='{"answer": "a } [1]",'), MagicMock(text=' "citations": []}'), MagicMock(text="ignored")]
+    with mock_gemini(return_value=MagicMock(__iter__=lambda self: iter(chunks))):
+        text = cached_generate("prompt", stream=True, json_mode=True)
+
+    assert json.loads(text) == {"answer": "a } [1]", "citations": []}
+
+def test_rate_limiter_spaces_requests_after_burst():
+    limiter = cli._RateLimiter(rate=50, burst=2)
+    start = time.monotonic()
+    for _ in range(4):
+        limiter.acquire()
+    # Two requests ride the burst, the next two wait 1/50 s each
+    assert time.monotonic() - start >= 0.035